@@ -0,0 +1,208 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from typing import List, Optional, Tuple
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed by the admission controller"""
+    def __init__(self, status_code: int, message: str, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class AdmissionController:
+    def __init__(self,
+                 db_path: Optional[str] = None,
+                 rate: float = 0.5,
+                 burst: int = 5,
+                 ip_rate: float = 2.0,
+                 ip_burst: int = 20,
+                 max_in_flight: int = 8,
+                 max_queue: int = 16,
+                 queue_timeout: float = 5.0,
+                 lease_seconds: float = 120.0):
+        """
+        Initialize per-user rate limiting and a global in-flight limit
+
+        State lives in a local SQLite file so every uvicorn worker on the host
+        shares the same buckets and in-flight slots.
+
+        Args:
+            db_path: Path of the shared SQLite file
+            rate: Tokens added to each user bucket per second
+            burst: User bucket capacity
+            ip_rate: Tokens added to each client IP bucket per second
+            ip_burst: Client IP bucket capacity
+            max_in_flight: Requests allowed to run at once across all workers
+            max_queue: Requests allowed to wait for a slot in this worker
+            queue_timeout: Seconds a queued request waits before being shed
+            lease_seconds: Age after which a slot held by a crashed worker is reclaimed
+        """
+        try:
+            self.db_path = db_path or os.path.join(tempfile.gettempdir(), "eatgood_admission.sqlite3")
+            self.rate = rate
+            self.burst = burst
+            self.ip_rate = ip_rate
+            self.ip_burst = ip_burst
+            # A bucket idle this long has refilled completely and is equivalent to no row
+            self.idle_seconds = max(burst / rate, ip_burst / ip_rate)
+            self.last_prune = 0.0
+            self.max_in_flight = max_in_flight
+            self.max_queue = max_queue
+            self.queue_timeout = queue_timeout
+            self.lease_seconds = lease_seconds
+            self.waiting = 0
+
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS buckets "
+                    "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated_at ON buckets (updated_at)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS in_flight "
+                    "(slot_id TEXT PRIMARY KEY, started_at REAL NOT NULL)"
+                )
+            logger.info(f"Initialized AdmissionController with store: {self.db_path}")
+        except Exception as e:
+            logger.error(f"Failed to initialize AdmissionController: {str(e)}")
+            raise
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None so BEGIN IMMEDIATE controls the write lock explicitly
+        return sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+
+    def take_tokens(self, buckets: List[Tuple[str, float, int]]) -> float:
+        """
+        Take one token from each of the given (key, rate, burst) buckets, all or nothing
+
+        Returns:
+            0 if the request is allowed, otherwise seconds until every bucket has a token
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+
+            # Full, idle buckets carry no state; drop them so the table stays bounded
+            if now - self.last_prune >= self.idle_seconds:
+                conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.idle_seconds,))
+                self.last_prune = now
+
+            levels = []
+            wait = 0.0
+            for key, rate, burst in buckets:
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                levels.append((key, tokens))
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+
+            # Rejected requests write nothing: unchanged buckets keep refilling from their
+            # stored state, and unknown keys do not get a row
+            if wait == 0:
+                for key, tokens in levels:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                        (key, tokens - 1, now)
+                    )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def try_acquire_slot(self) -> Optional[str]:
+        """Claim a global in-flight slot, returning its id or None when all are taken"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM in_flight WHERE started_at < ?", (now - self.lease_seconds,))
+            (count,) = conn.execute("SELECT COUNT(*) FROM in_flight").fetchone()
+
+            slot_id = None
+            if count < self.max_in_flight:
+                slot_id = uuid.uuid4().hex
+                conn.execute("INSERT INTO in_flight (slot_id, started_at) VALUES (?, ?)", (slot_id, now))
+            conn.execute("COMMIT")
+            return slot_id
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def release_slot(self, slot_id: str) -> None:
+        """Give back an in-flight slot"""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM in_flight WHERE slot_id = ?", (slot_id,))
+        finally:
+            conn.close()
+
+    async def acquire(self, client_ip: str, user_id: Optional[str] = None) -> str:
+        """
+        Admit a request or shed it
+
+        The client IP is always charged, so an unauthenticated X-User-ID that
+        changes per request cannot bypass the limit; the user bucket applies on top.
+
+        Args:
+            client_ip: Address of the client
+            user_id: Optional user id from the X-User-ID header
+
+        Returns:
+            In-flight slot id, to be passed to release()
+
+        Raises:
+            AdmissionRejected: 429 when the key is over its rate, 503 when the server is saturated
+        """
+        buckets = [(f"ip:{client_ip}", self.ip_rate, self.ip_burst)]
+        if user_id:
+            buckets.append((f"user:{user_id}", self.rate, self.burst))
+        retry_after = await asyncio.to_thread(self.take_tokens, buckets)
+        if retry_after > 0:
+            logger.warning(f"Rate limit exceeded for {', '.join(key for key, _, _ in buckets)}")
+            raise AdmissionRejected(429, "Too many requests", retry_after)
+
+        slot_id = await asyncio.to_thread(self.try_acquire_slot)
+        if slot_id:
+            return slot_id
+
+        # Bounded wait queue: shed immediately once it is full
+        if self.waiting >= self.max_queue:
+            logger.warning("Admission queue full, shedding request")
+            raise AdmissionRejected(503, "Server is busy", self.queue_timeout)
+
+        self.waiting += 1
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                slot_id = await asyncio.to_thread(self.try_acquire_slot)
+                if slot_id:
+                    return slot_id
+        finally:
+            self.waiting -= 1
+
+        logger.warning("Timed out waiting for an in-flight slot, shedding request")
+        raise AdmissionRejected(503, "Server is busy", self.queue_timeout)
+
+    async def release(self, slot_id: str) -> None:
+        """Release a slot obtained from acquire()"""
+        try:
+            await asyncio.to_thread(self.release_slot, slot_id)
+        except Exception as e:
+            # The lease expiry reclaims the slot if this fails
+            logger.exception(f"Error releasing in-flight slot: {str(e)}")
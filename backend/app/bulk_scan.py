@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set
+import logging
+
+from google.api_core import exceptions as api_exceptions
+from google.genai import errors as genai_errors
+
+from vision import VisionProcessor
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+# Failures worth retrying on the next run; anything else is a final result for the image
+TRANSIENT_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.InternalServerError,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError,
+    BrokenExecutor,
+)
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failure is worth retrying (Gemini errors carry an HTTP status code)"""
+    if isinstance(error, genai_errors.APIError):
+        return error.code in (408, 429) or (error.code or 0) >= 500
+    return isinstance(error, TRANSIENT_ERRORS)
+
+def iter_images(source: str) -> Iterator[str]:
+    """
+    Stream image paths from a directory (recursively) or a manifest file
+
+    A manifest is a text file with one image path per line, relative paths
+    being resolved against the manifest's directory.
+    """
+    if os.path.isdir(source):
+        stack = [source]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield entry.path
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as manifest:
+            for line in manifest:
+                path = line.strip()
+                if path and not path.startswith("#"):
+                    yield path if os.path.isabs(path) else os.path.join(base, path)
+
+# Process pool tasks (module level so they can be pickled)
+def load_image(path: str, preprocess: bool) -> bytes:
+    """Read an image and optionally binarize it for OCR"""
+    with open(path, "rb") as image_file:
+        image_bytes = image_file.read()
+    return VisionProcessor.preprocess_image(image_bytes) if preprocess else image_bytes
+
+def parse_text(text: str) -> Dict:
+    """Parse nutrition facts from OCR text"""
+    return VisionProcessor._parse_nutrition_facts(text)
+
+class Checkpoint:
+    """Append-only list of image paths whose final result is safely written"""
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.done = {line.rstrip("\n") for line in checkpoint_file if line.strip()}
+        self.file = open(path, "a")
+
+    def mark(self, paths: List[str]) -> None:
+        self.file.write("".join(f"{path}\n" for path in paths))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.done.update(paths)
+
+    def close(self) -> None:
+        self.file.close()
+
+class JsonlWriter:
+    """Write one JSON record per line, flushing every record"""
+    def __init__(self, path: str, checkpoint: Checkpoint):
+        self.file = open(path, "a")
+        self.checkpoint = checkpoint
+
+    def write(self, record: Dict) -> None:
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        if not record.get("retryable"):
+            self.checkpoint.mark([record["path"]])
+
+    def close(self) -> None:
+        self.file.close()
+
+class ParquetWriter:
+    """Write records as numbered Parquet part files in a directory"""
+    def __init__(self, path: str, checkpoint: Checkpoint, batch_size: int = 1000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.records: List[Dict] = []
+        os.makedirs(path, exist_ok=True)
+        self.part = len([name for name in os.listdir(path) if name.endswith(".parquet")])
+
+    def write(self, record: Dict) -> None:
+        self.records.append(record)
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.records:
+            return
+        rows = [
+            {
+                "path": r["path"],
+                "error": r.get("error"),
+                "retryable": bool(r.get("retryable")),
+                "nutrition_data": json.dumps(r.get("nutrition_data"), ensure_ascii=False),
+                "analysis": json.dumps(r.get("analysis"), ensure_ascii=False),
+            }
+            for r in self.records
+        ]
+        part_path = os.path.join(self.path, f"part-{self.part:05d}.parquet")
+        self.pq.write_table(self.pa.Table.from_pylist(rows), part_path)
+        self.part += 1
+        self.checkpoint.mark([r["path"] for r in self.records if not r.get("retryable")])
+        self.records = []
+
+    def close(self) -> None:
+        self.flush()
+
+class BulkScanner:
+    def __init__(self,
+                 output: str,
+                 output_format: str = "jsonl",
+                 checkpoint_path: Optional[str] = None,
+                 workers: Optional[int] = None,
+                 concurrency: int = 16,
+                 preprocess: bool = False,
+                 analyze: bool = False,
+                 report_every: float = 10.0):
+        """
+        Initialize the bulk scanner
+
+        Args:
+            output: JSONL file, or directory of Parquet parts
+            output_format: "jsonl" or "parquet"
+            checkpoint_path: File listing completed images (defaults to output + ".checkpoint")
+            workers: Process pool size for preprocessing and parsing
+            concurrency: Maximum concurrent upstream (Vision/Gemini) calls
+            preprocess: Whether to binarize images before OCR
+            analyze: Whether to run the Gemini analysis on each product
+            report_every: Seconds between throughput reports
+        """
+        self.checkpoint = Checkpoint(checkpoint_path or f"{output.rstrip(os.sep)}.checkpoint")
+        if output_format == "parquet":
+            self.writer = ParquetWriter(output, self.checkpoint)
+        else:
+            self.writer = JsonlWriter(output, self.checkpoint)
+        self.workers = workers
+        self.concurrency = concurrency
+        self.preprocess = preprocess
+        self.report_every = report_every
+        self.vision_processor = VisionProcessor()
+
+        self.nutrition_analyzer = None
+        if analyze:
+            # Imported lazily: creating the Gemini client is only needed for analysis
+            from gpt_handler import NutritionAnalyzer
+            self.nutrition_analyzer = NutritionAnalyzer()
+
+        self.processed = 0
+        self.errors = 0
+        self.skipped = 0
+
+    async def _scan_one(self, path: str, pool: ProcessPoolExecutor, upstream: asyncio.Semaphore) -> Dict:
+        loop = asyncio.get_running_loop()
+        try:
+            image_bytes = await loop.run_in_executor(pool, load_image, path, self.preprocess)
+
+            async with upstream:
+                text = await asyncio.to_thread(self.vision_processor.detect_full_text, image_bytes)
+            if text is None:
+                return {"path": path, "error": "No text detected in the image"}
+
+            nutrition_data = await loop.run_in_executor(pool, parse_text, text)
+            record = {"path": path, "nutrition_data": nutrition_data}
+
+            if self.nutrition_analyzer:
+                async with upstream:
+                    # Errors are raised so they can be classified below; a returned failure
+                    # (an unparseable answer) is final
+                    analysis = await asyncio.to_thread(
+                        self.nutrition_analyzer.analyze_nutrition, nutrition_data, raise_errors=True
+                    )
+                record["analysis"] = analysis.get("analysis")
+                if not analysis.get("success"):
+                    record["error"] = analysis.get("error")
+            return record
+
+        except Exception as e:
+            retryable = is_transient(e)
+            logger.error(f"Error scanning {path}{' (will retry on resume)' if retryable else ''}: {str(e)}")
+            logger.debug(f"Traceback for {path}", exc_info=True)
+            return {"path": path, "error": str(e), "retryable": retryable}
+
+    def _report(self, started: float) -> None:
+        elapsed = time.monotonic() - started
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        logger.info(
+            f"Processed {self.processed} images ({self.errors} errors, {self.skipped} skipped) "
+            f"in {elapsed:.1f}s - {rate:.2f} images/s"
+        )
+
+    async def run(self, source: str) -> None:
+        """Scan every image from the source that is not already checkpointed"""
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency))
+        upstream = asyncio.Semaphore(self.concurrency)
+        # Enough tasks in flight to keep both the pool and the upstream calls busy
+        max_pending = self.concurrency + (self.workers or os.cpu_count() or 1) * 2
+
+        started = last_report = time.monotonic()
+        pending = set()
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                for path in iter_images(source):
+                    if path in self.checkpoint.done:
+                        self.skipped += 1
+                        continue
+                    pending.add(asyncio.create_task(self._scan_one(path, pool, upstream)))
+
+                    if len(pending) >= max_pending:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        self._collect(done)
+
+                    if time.monotonic() - last_report >= self.report_every:
+                        self._report(started)
+                        last_report = time.monotonic()
+
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    self._collect(done)
+                    if time.monotonic() - last_report >= self.report_every:
+                        self._report(started)
+                        last_report = time.monotonic()
+            finally:
+                self.writer.close()
+                self.checkpoint.close()
+
+        self._report(started)
+
+    def _collect(self, done) -> None:
+        for task in done:
+            record = task.result()
+            self.writer.write(record)
+            self.processed += 1
+            if record.get("error"):
+                self.errors += 1
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk scan a directory or manifest of product images")
+    parser.add_argument("source", help="Directory of images or manifest file with one path per line")
+    parser.add_argument("output", help="Output JSONL file, or directory for Parquet parts")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="Output format")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--workers", type=int, help="Process pool size (default: CPU count)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent Vision/Gemini calls")
+    parser.add_argument("--preprocess", action="store_true", help="Binarize images before OCR")
+    parser.add_argument("--analyze", action="store_true", help="Run the Gemini analysis on each product")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between throughput reports")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    # Per-image logs from the pipeline stages would drown the progress reports
+    logging.getLogger("vision").setLevel(logging.WARNING)
+    logging.getLogger("gpt_handler").setLevel(logging.WARNING)
+
+    scanner = BulkScanner(
+        output=args.output,
+        output_format=args.format,
+        checkpoint_path=args.checkpoint,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        preprocess=args.preprocess,
+        analyze=args.analyze,
+        report_every=args.report_every,
+    )
+    asyncio.run(scanner.run(args.source))
+
+if __name__ == "__main__":
+    main()
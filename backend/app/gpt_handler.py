@@ -1,10 +1,16 @@
 import os
 import json
+import threading
+import time
 from typing import Dict, List, Any, Optional
+from cachetools import TTLCache
 from google import genai
+from google.genai import types
 from pydantic import BaseModel, Field
 import logging
-import traceback
+
+from prompts import SYSTEM_INSTRUCTION, PRODUCT_SYSTEM_INSTRUCTION, build_user_prompt, estimate_tokens
+from personalization import find_allergen_conflicts, personalize, product_key
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -33,124 +39,231 @@ class UserProfile(BaseModel):
     daily_calorie_target: Optional[int] = None
     activity_level: Optional[str] = None  # "sedentary", "moderate", "active", "very active"
 
+# USD per million (input, output) tokens, used to estimate per-tier cost
+MODEL_PRICING = {
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+}
+
+# Fields the analysis must contain to be accepted from the cheap tier
+REQUIRED_ANALYSIS_FIELDS = ["summary", "health_score", "positive_aspects", "concerns"]
+
 class NutritionAnalyzer:
-    def __init__(self, model_name="gemini-2.0-flash"):
-        """Initialize the Nutrition Analyzer with Gemini model"""
+    def __init__(self,
+                 model_name="gemini-2.0-flash",
+                 cascade_model_name: Optional[str] = None,
+                 raw_text_token_budget: int = 200,
+                 product_cache_size: int = 10000,
+                 product_cache_ttl: float = 24 * 3600):
+        """
+        Initialize the Nutrition Analyzer with Gemini model
+        
+        Args:
+            model_name: The larger model, always used when escalating
+            cascade_model_name: Optional cheaper model tried first; None disables the cascade
+            raw_text_token_budget: Token budget for the OCR excerpt included in the prompt
+            product_cache_size: Number of product-level analyses kept in memory
+            product_cache_ttl: Seconds a product-level analysis stays cached
+        """
         try:
             self.model_name = model_name
+            self.cascade_model_name = cascade_model_name or None
             self.client = client
-            logger.info(f"Initialized NutritionAnalyzer with model: {model_name}")
+            self.raw_text_token_budget = raw_text_token_budget
+            # Static instructions are built once and reused by every request
+            self.generation_config = types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION)
+            self.product_generation_config = types.GenerateContentConfig(system_instruction=PRODUCT_SYSTEM_INSTRUCTION)
+            # Profile-independent analyses shared by every user scanning the same product
+            self.product_cache = TTLCache(maxsize=product_cache_size, ttl=product_cache_ttl)
+            self.cache_lock = threading.Lock()
+            self.stats_lock = threading.Lock()
+            self.tier_stats = {}
+            self.escalations = {}
+            logger.info(f"Initialized NutritionAnalyzer with model: {model_name}"
+                        + (f" (cascade from {self.cascade_model_name})" if self.cascade_model_name else ""))
         except Exception as e:
             logger.error(f"Failed to initialize NutritionAnalyzer: {str(e)}")
             raise
         
-    def _create_analysis_prompt(self, nutrition_data: Dict, user_profile: Optional[UserProfile] = None) -> str:
+    def _create_analysis_prompt(self,
+                                nutrition_data: Dict,
+                                user_profile: Optional[UserProfile] = None,
+                                product_only: bool = False) -> str:
         """
-        Create a detailed prompt for the Gemini model based on nutrition data and user profile
+        Create the per-request prompt for the Gemini model based on nutrition data and user profile
+        
+        The static instructions and output schema are sent separately as the
+        system instruction (see prompts.SYSTEM_INSTRUCTION).
         
         Args:
             nutrition_data: Dictionary containing nutrition facts
             user_profile: Optional user profile for personalized recommendations
+            product_only: Whether this is for the profile-independent assessment
             
         Returns:
-            Structured prompt for the Gemini model
+            Compact prompt for the Gemini model
         """
         try:
-            # Extract nutrition information
-            calories = nutrition_data.get("calories", "unknown")
-            fat = nutrition_data.get("fat", "unknown")
-            carbs = nutrition_data.get("carbohydrates", "unknown")
-            protein = nutrition_data.get("protein", "unknown")
-            ingredients = nutrition_data.get("ingredients", [])
-            ingredients_text = ", ".join(ingredients) if ingredients else "unknown"
-            
-            # Base prompt structure
-            prompt = f"""
-            # Nutrition Analysis Task
-            
-            ## Product Information
-            - Calories: {calories} kcal
-            - Fat: {fat}g
-            - Carbohydrates: {carbs}g
-            - Protein: {protein}g
-            - Ingredients: {ingredients_text}
-            - Raw OCR Text: {nutrition_data.get("raw_text", "Not provided")}
-            
-            ## Analysis Requirements
-            
-            1. Provide a comprehensive health assessment of this food item 
-            2. Identify both positive nutritional aspects and potential concerns
-            3. Use a friendly, conversational tone with short, impactful statements
-            4. Include emoji where appropriate to make the analysis visually engaging
-            5. Format your analysis for easy scanning on a mobile app
-            6. If the food is not healthy, suggest healthier alternatives that can be found in the store
-            7. If the food is healthy, suggest ways to enjoy it in a balanced way
-            8. take into account the user's profile when making the analysis
-            9. write like you are a talking to the user
-            10 if the image is not food, just say that you cannot analyze it
-            """
-            
-            # Add personalized sections if user profile is available
-            if user_profile:
-                prompt += f"""
-                ## User Profile
-                - Name: {user_profile.name if user_profile.name else "User"}
-                - Weight Goal: {user_profile.weight_goal if user_profile.weight_goal else "Not specified"}
-                - Dietary Restrictions: {', '.join(user_profile.dietary_restrictions) if user_profile.dietary_restrictions else "None"}
-                - Allergies: {', '.join(user_profile.allergies) if user_profile.allergies else "None"}
-                - Health Conditions: {', '.join(user_profile.health_conditions) if user_profile.health_conditions else "None"}
-                - Daily Calorie Target: {user_profile.daily_calorie_target if user_profile.daily_calorie_target else "Not specified"}
-                - Activity Level: {user_profile.activity_level if user_profile.activity_level else "Not specified"}
-                
-                ## Personalization Requirements
-                1. Evaluate if this food aligns with the user's dietary preferences and restrictions
-                2. Assess if any ingredients conflict with the user's allergies (highlight these as warnings)
-                3. Determine if this food is appropriate for their weight goal and health conditions
-                4. Suggest how this food might fit into their daily calorie target
-                5. talk to the user like you are a friend
-                """
-                
-            # Output structuring requirements
-            prompt += """
-            ## Output Format
-            Structure your response in JSON format with the following fields:
-            
-            ```json
-            {
-              "summary": "One-sentence overview with emoji",
-              "health_score": "A number from 1-10 with 10 being extremely healthy",
-              "positive_aspects": ["List of 2-3 positive nutritional aspects with emoji"],
-              "concerns": ["List of 2-3 nutritional concerns with emoji"],
-              "allergen_warnings": ["List of potential allergens found in ingredients"],
-              "alternatives": ["List of 2-3 healthier alternatives if applicable mention the name of the alternative that can be found in the store"],
-              "tips": ["1-2 tips on how to enjoy this food in a balanced way"],
-              "fit_for_user": "Whether this food fits the user's profile (Yes/No/Partially)",
-              "explanation": "2-3 sentences explaining the fit assessment"
-            }
-            ```
-            
-            Return ONLY the JSON object without any additional text or explanations. Ensure the JSON is valid and properly formatted.
-            """
-            
+            prompt = build_user_prompt(nutrition_data, user_profile, self.raw_text_token_budget, product_only)
             logger.debug("Successfully created analysis prompt")
             return prompt
             
         except Exception as e:
             logger.error(f"Error creating analysis prompt: {str(e)}")
-            logger.error(traceback.format_exc())
             raise
         
+    def _generate(self, prompt: str, model_name: str, product_only: bool = False) -> Dict:
+        """
+        Send a prompt to one model and parse its JSON answer, recording tier counters
+        
+        Returns:
+            Dictionary with success and either the parsed analysis or an error
+        """
+        if product_only:
+            system_instruction, config = PRODUCT_SYSTEM_INSTRUCTION, self.product_generation_config
+        else:
+            system_instruction, config = SYSTEM_INSTRUCTION, self.generation_config
+        estimated_tokens = estimate_tokens(system_instruction) + estimate_tokens(prompt)
+        logger.info(f"Sending request to Gemini API ({model_name}, ~{estimated_tokens} input tokens)")
+        start = time.perf_counter()
+        response = self.client.models.generate_content(
+            model=model_name,
+            contents=prompt,
+            config=config,
+        )
+        latency = time.perf_counter() - start
+        usage_metadata = getattr(response, "usage_metadata", None)
+        self._record_call(model_name, latency, usage_metadata)
+        usage = {
+            "estimated_input_tokens": estimated_tokens,
+            "input_tokens": getattr(usage_metadata, "prompt_token_count", None),
+            "output_tokens": getattr(usage_metadata, "candidates_token_count", None),
+            "latency_s": round(latency, 3),
+        }
+        
+        # Parse the JSON response
+        try:
+            # Remove any markdown formatting if present (```json and ```)
+            response_text = response.text
+            if "```json" in response_text:
+                response_text = response_text.split("```json")[1].split("```")[0].strip()
+            elif "```" in response_text:
+                response_text = response_text.split("```")[1].split("```")[0].strip()
+            
+            analysis_result = json.loads(response_text)
+            logger.info("Successfully parsed Gemini response")
+            return {"success": True, "analysis": analysis_result, "usage": usage}
+        except json.JSONDecodeError as e:
+            error_msg = "Failed to parse Gemini response as JSON"
+            logger.error(f"{error_msg}: {str(e)}")
+            logger.error(f"Raw response: {response.text}")
+            return {
+                "success": False,
+                "error": error_msg,
+                "raw_response": response.text,
+                "usage": usage
+            }
+    
+    def _record_call(self, model_name: str, latency: float, usage) -> None:
+        """Accumulate request count, latency, tokens and estimated cost for a tier"""
+        input_tokens = getattr(usage, "prompt_token_count", None) or 0
+        output_tokens = getattr(usage, "candidates_token_count", None) or 0
+        input_price, output_price = MODEL_PRICING.get(model_name, (0.0, 0.0))
+        with self.stats_lock:
+            stats = self.tier_stats.setdefault(model_name, {
+                "requests": 0,
+                "total_latency_s": 0.0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "estimated_cost_usd": 0.0,
+            })
+            stats["requests"] += 1
+            stats["total_latency_s"] += latency
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["estimated_cost_usd"] += (input_tokens * input_price + output_tokens * output_price) / 1e6
+    
+    def get_tier_stats(self) -> Dict:
+        """Per-tier routing, latency and cost counters"""
+        with self.stats_lock:
+            tiers = {}
+            for model_name, stats in self.tier_stats.items():
+                tiers[model_name] = {
+                    **stats,
+                    "avg_latency_s": stats["total_latency_s"] / stats["requests"] if stats["requests"] else 0.0,
+                }
+            return {
+                "cascade_enabled": self.cascade_model_name is not None,
+                "tiers": tiers,
+                "escalations": dict(self.escalations),
+            }
+    
+    def _needs_large_model(self, nutrition_data: Dict, user_profile: Optional[UserProfile]) -> Optional[str]:
+        """
+        Decide up front whether the cheap tier should be skipped
+        
+        Returns:
+            The escalation reason, or None if the cheap tier may be tried
+        """
+        if user_profile:
+            constraints = len(user_profile.allergies) + len(user_profile.dietary_restrictions)
+            if user_profile.health_conditions:
+                return "profile_health_conditions"
+            if constraints >= 3:
+                return "profile_constraints"
+        if len(nutrition_data.get("ingredients") or []) > 15:
+            return "complex_ingredients"
+        return None
+    
+    def _validate_cheap_result(self, result: Dict, nutrition_data: Dict, user_profile: Optional[UserProfile]) -> Optional[str]:
+        """
+        Check a cheap tier answer before accepting it
+        
+        Returns:
+            The escalation reason, or None if the answer is acceptable
+        """
+        if not result.get("success"):
+            return "invalid_json"
+        analysis = result["analysis"]
+        if any(not analysis.get(field) for field in REQUIRED_ANALYSIS_FIELDS):
+            return "missing_fields"
+        try:
+            if not 1 <= int(analysis["health_score"]) <= 10:
+                return "invalid_health_score"
+        except (TypeError, ValueError):
+            return "invalid_health_score"
+        if user_profile and str(analysis.get("fit_for_user")) not in ("Yes", "No", "Partially"):
+            return "invalid_fit"
+        # Low confidence: one of the user's allergens is in the ingredients but the model missed it
+        if user_profile and user_profile.allergies:
+            ingredients = [str(i) for i in nutrition_data.get("ingredients") or []]
+            warnings = [str(w) for w in analysis.get("allergen_warnings") or []]
+            present = find_allergen_conflicts(user_profile.allergies, ingredients, [])
+            if set(present) - set(find_allergen_conflicts(present, [], warnings)):
+                return "missed_allergen"
+        return None
+    
     def analyze_nutrition(self, 
                          nutrition_data: Dict, 
                          user_profile: Optional[UserProfile] = None,
-                         product_name: Optional[str] = None) -> Dict:
+                         product_name: Optional[str] = None,
+                         product_only: bool = False,
+                         escalate_reason: Optional[str] = None,
+                         raise_errors: bool = False) -> Dict:
         """
         Analyze nutrition data using Gemini API
         
+        When a cascade model is configured, it is tried first and the larger
+        model is only called if the request is complex or the answer fails validation.
+        
         Args:
             nutrition_data: Dictionary containing nutrition facts
             user_profile: Optional user profile for personalized analysis
             product_name: Optional product name
+            product_only: Use the profile-independent schema (no fit fields); user_profile is ignored
+            escalate_reason: Skip the cheap tier for this reason (decided by the caller)
+            raise_errors: Re-raise API and other errors instead of returning them, so the
+                caller can tell transient failures from permanent ones
             
         Returns:
             Dictionary with analysis results
@@ -165,47 +278,173 @@ class NutritionAnalyzer:
                 enriched_data = nutrition_data
             
             # Generate the prompt
-            prompt = self._create_analysis_prompt(enriched_data, user_profile)
+            if product_only:
+                user_profile = None
+            prompt = self._create_analysis_prompt(enriched_data, user_profile, product_only)
             
-            # Get response from Gemini
-            logger.info("Sending request to Gemini API")
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-            )
+            model_name = self.model_name
+            result = None
+            if self.cascade_model_name:
+                reason = escalate_reason or self._needs_large_model(nutrition_data, user_profile)
+                if reason is None:
+                    model_name = self.cascade_model_name
+                    try:
+                        result = self._generate(prompt, model_name, product_only)
+                        reason = self._validate_cheap_result(result, nutrition_data, user_profile)
+                    except Exception as e:
+                        logger.warning(f"Cascade model {model_name} failed: {str(e)}")
+                        reason = "cheap_tier_error"
+                if reason is not None:
+                    logger.info(f"Escalating analysis to {self.model_name}: {reason}")
+                    with self.stats_lock:
+                        self.escalations[reason] = self.escalations.get(reason, 0) + 1
+                    model_name = self.model_name
+                    result = None
             
-            # Parse the JSON response
-            try:
-                # Remove any markdown formatting if present (```json and ```)
-                response_text = response.text
-                if "```json" in response_text:
-                    response_text = response_text.split("```json")[1].split("```")[0].strip()
-                elif "```" in response_text:
-                    response_text = response_text.split("```")[1].split("```")[0].strip()
-                
-                analysis_result = json.loads(response_text)
-                logger.info("Successfully parsed Gemini response")
-                
-                return {
-                    "success": True,
-                    "product_name": product_name or "Food Item",
-                    "nutrition_data": nutrition_data,
-                    "analysis": analysis_result
-                }
-            except json.JSONDecodeError as e:
-                error_msg = "Failed to parse Gemini response as JSON"
-                logger.error(f"{error_msg}: {str(e)}")
-                logger.error(f"Raw response: {response.text}")
-                return {
-                    "success": False,
-                    "error": error_msg,
-                    "raw_response": response.text
-                }
+            if result is None:
+                result = self._generate(prompt, model_name, product_only)
+            
+            if not result.get("success"):
+                return result
+            
+            return {
+                "success": True,
+                "product_name": product_name or "Food Item",
+                "nutrition_data": nutrition_data,
+                "analysis": result["analysis"],
+                "model": model_name,
+                "usage": result["usage"]
+            }
                 
         except Exception as e:
+            if raise_errors:
+                raise
             error_msg = f"Error in nutrition analysis: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            logger.exception(error_msg)
+            return {
+                "success": False,
+                "error": error_msg
+            }
+    
+    def analyze_product(self,
+                        nutrition_data: Dict,
+                        product_name: Optional[str] = None,
+                        escalate_reason: Optional[str] = None) -> Dict:
+        """
+        Profile-independent product assessment, cached per product
+        
+        Args:
+            nutrition_data: Dictionary containing nutrition facts
+            product_name: Optional product name
+            escalate_reason: Require the larger model; a cached cheap-tier answer is regenerated
+            
+        Returns:
+            Result of analyze_nutrition plus "cached". Cache hits carry no "model"
+            and zero usage, since this request spent nothing.
+        """
+        key = product_key(nutrition_data, product_name)
+        cached = None
+        if key is not None:
+            with self.cache_lock:
+                cached = self.product_cache.get(key)
+        if cached is not None and escalate_reason and self.cascade_model_name \
+                and cached.get("model") != self.model_name:
+            logger.info(f"Upgrading cached product analysis to {self.model_name}: {escalate_reason}")
+            cached = None
+        if cached is not None:
+            logger.info(f"Product analysis cache hit for: {product_name or 'Unknown'}")
+            hit = {k: v for k, v in cached.items() if k not in ("model", "usage")}
+            return {
+                **hit,
+                "nutrition_data": nutrition_data,
+                "usage": {"estimated_input_tokens": 0, "input_tokens": 0, "output_tokens": 0, "latency_s": 0.0},
+                "cached": True
+            }
+        
+        result = self.analyze_nutrition(
+            nutrition_data,
+            product_name=product_name,
+            product_only=True,
+            escalate_reason=escalate_reason
+        )
+        if not result.get("success"):
+            return result
+        
+        if key is not None:
+            with self.cache_lock:
+                self.product_cache[key] = result
+        return {**result, "cached": False}
+    
+    def _explain_fit(self,
+                     analysis: Dict,
+                     overlay: Dict,
+                     nutrition_data: Dict,
+                     user_profile: UserProfile,
+                     product_name: Optional[str]) -> str:
+        """Ask the model for a personalized explanation of the locally computed fit"""
+        prompt = "\n".join([
+            "In 2-3 friendly sentences with emoji, talk to the user and explain why this food "
+            f"is a '{overlay['fit_for_user']}' fit for them. Return only the explanation text.",
+            f"Product: {product_name or 'Food Item'}; summary: {analysis.get('summary', '')}; "
+            f"health score: {analysis.get('health_score', 'unknown')}",
+            f"Calories: {nutrition_data.get('calories', 'unknown')}; ingredients: "
+            f"{', '.join(str(i) for i in nutrition_data.get('ingredients') or []) or 'unknown'}",
+            f"User: weight goal {user_profile.weight_goal or 'not specified'}; "
+            f"daily calorie target {user_profile.daily_calorie_target or 'not specified'}; "
+            f"restrictions {', '.join(user_profile.dietary_restrictions) or 'none'}; "
+            f"allergies {', '.join(user_profile.allergies) or 'none'}; "
+            f"health conditions {', '.join(user_profile.health_conditions) or 'none'}",
+            f"Findings: {overlay['explanation']}",
+        ])
+        model_name = self.cascade_model_name or self.model_name
+        start = time.perf_counter()
+        response = self.client.models.generate_content(model=model_name, contents=prompt)
+        self._record_call(model_name, time.perf_counter() - start, getattr(response, "usage_metadata", None))
+        return response.text.strip()
+    
+    def analyze_personalized(self,
+                             nutrition_data: Dict,
+                             user_profile: Optional[UserProfile] = None,
+                             product_name: Optional[str] = None,
+                             explain: bool = False) -> Dict:
+        """
+        Two-layer analysis: cached product assessment plus a local per-user overlay
+        
+        Args:
+            nutrition_data: Dictionary containing nutrition facts
+            user_profile: Optional user profile for the overlay
+            product_name: Optional product name
+            explain: Whether to call the model for a personalized explanation
+            
+        Returns:
+            Dictionary in the same shape as analyze_nutrition
+        """
+        # Profiles that need the larger model get a large-model product assessment
+        # (allergen checks against the ingredients happen locally in the overlay)
+        escalate_reason = None
+        if self.cascade_model_name and user_profile:
+            escalate_reason = self._needs_large_model(nutrition_data, user_profile)
+        
+        result = self.analyze_product(nutrition_data, product_name, escalate_reason)
+        if not result.get("success"):
+            return result
+        
+        try:
+            overlay = personalize(result["analysis"], nutrition_data, user_profile)
+            if explain and user_profile:
+                try:
+                    overlay["explanation"] = self._explain_fit(
+                        result["analysis"], overlay, nutrition_data, user_profile, product_name
+                    )
+                except Exception as e:
+                    # Keep the local explanation if the model call fails
+                    logger.warning(f"Personalized explanation failed: {str(e)}")
+            
+            return {**result, "analysis": {**result["analysis"], **overlay}}
+            
+        except Exception as e:
+            error_msg = f"Error in personalization: {str(e)}"
+            logger.exception(error_msg)
             return {
                 "success": False,
                 "error": error_msg
@@ -262,8 +501,7 @@ class NutritionAnalyzer:
             }
             
         except Exception as e:
-            logger.error(f"Error generating visual verdict: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception(f"Error generating visual verdict: {str(e)}")
             return {
                 "title": "Error",
                 "color": "#F44336",
@@ -301,8 +539,7 @@ def get_user_profile(user_id: str) -> Optional[UserProfile]:
         return profile
         
     except Exception as e:
-        logger.error(f"Error getting user profile: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error getting user profile: {str(e)}")
         return None
 
 # Example usage
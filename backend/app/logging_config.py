@@ -0,0 +1,193 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Request ID of the request being handled, set by the middleware in main.py
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request ID to every record (runs in the calling thread)"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class TracebackSampler(logging.Filter):
+    """
+    Rate-limit repeated tracebacks
+
+    Records carrying exc_info are grouped by logger, exception type and the
+    line that raised. The first `burst` of each group per `window` seconds keep
+    their traceback; later ones are logged without it, and the number dropped
+    is reported on the next traceback let through.
+    """
+    def __init__(self, burst: int = 5, window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.lock = threading.Lock()
+        self.groups: Dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not record.exc_info or not record.exc_info[1]:
+            return True
+
+        exc_type, _, tb = record.exc_info
+        while tb is not None and tb.tb_next is not None:
+            tb = tb.tb_next
+        origin = (tb.tb_frame.f_code.co_filename, tb.tb_lineno) if tb is not None else None
+        key = (record.name, exc_type, origin)
+
+        now = time.monotonic()
+        with self.lock:
+            group = self.groups.setdefault(key, [now, 0, 0])  # window start, emitted, suppressed
+            if now - group[0] >= self.window:
+                group[0], group[1] = now, 0
+            if group[1] < self.burst:
+                group[1] += 1
+                suppressed, group[2] = group[2], 0
+            else:
+                group[2] += 1
+                suppressed = None
+
+        if suppressed is None:
+            # Keep the message, drop the traceback before anything formats it
+            record.exc_info = None
+            record.exc_text = None
+            record.traceback_suppressed = True
+        elif suppressed:
+            record.suppressed_tracebacks = suppressed
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if getattr(record, "traceback_suppressed", False):
+            entry["traceback_suppressed"] = True
+        if getattr(record, "suppressed_tracebacks", 0):
+            entry["suppressed_tracebacks"] = record.suppressed_tracebacks
+        return json.dumps(entry, ensure_ascii=False)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread
+
+    The stock handler formats the record (including the traceback) before
+    enqueueing it, which would keep that work on the event loop.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # This is the only root handler, so the record can be updated in place
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def parse_levels(spec: Optional[str]) -> Dict[str, str]:
+    """Parse "vision=WARNING,gpt_handler=DEBUG" into a mapping of logger name to level"""
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging(log_file: Optional[str] = "app.log",
+                  level: str = "INFO",
+                  module_levels: Optional[Dict[str, str]] = None,
+                  traceback_burst: int = 5,
+                  traceback_window: float = 60.0) -> logging.handlers.QueueListener:
+    """
+    Route all logging through a queue to a background thread writing JSON lines
+
+    Args:
+        log_file: File to write to, or None for the console only
+        level: Root level
+        module_levels: Per-logger levels, e.g. {"vision": "WARNING"}
+        traceback_burst: Tracebacks kept per group and window
+        traceback_window: Seconds per sampling window
+
+    Returns:
+        The started listener (stopped automatically at exit)
+    """
+    formatter = JsonFormatter()
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(TracebackSampler(traceback_burst, traceback_window))
+
+    # Process names are not part of the JSON output; skip looking them up per record
+    logging.logMultiprocessing = False
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_listener, listener)
+    return listener
+
+def stop_listener(listener: logging.handlers.QueueListener) -> None:
+    """Flush queued records and stop the listener thread (safe to call twice)"""
+    if listener._thread is not None:
+        listener.stop()
+
+# Measure the cost of a log call on the calling thread
+if __name__ == "__main__":
+    import tempfile
+
+    runs = 20000
+    log_dir = tempfile.mkdtemp()
+    bench = logging.getLogger("bench")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler(os.path.join(log_dir, "sync.log"))]
+    )
+    start = time.perf_counter()
+    for i in range(runs):
+        bench.info(f"Successfully detected {i} text blocks")
+    sync_time = (time.perf_counter() - start) / runs
+
+    listener = setup_logging(os.path.join(log_dir, "queued.log"))
+    listener.handlers = listener.handlers[1:]  # file only, like the synchronous run
+    # Time the calling thread alone, then let the listener drain the queue
+    stop_listener(listener)
+    start = time.perf_counter()
+    for i in range(runs):
+        bench.info(f"Successfully detected {i} text blocks")
+    queued_time = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    listener.start()
+    stop_listener(listener)
+    drain_time = (time.perf_counter() - start) / runs
+
+    print(f"Synchronous FileHandler: {sync_time * 1e6:.1f} us per log call on the caller")
+    print(f"Queued JSON logging:     {queued_time * 1e6:.1f} us per log call on the caller "
+          f"(+{drain_time * 1e6:.1f} us in the background thread)")
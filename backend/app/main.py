@@ -1,28 +1,34 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Header, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Header, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, List, Any
+import asyncio
 import json
+import math
 import os
 import logging
+import uuid
 from datetime import datetime
-import traceback
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
+
+# Configure logging: JSON lines written by a background thread, off the event loop
+# LOG_LEVELS sets per-module levels, e.g. "vision=WARNING,gpt_handler=INFO"
+from logging_config import setup_logging, parse_levels, request_id_var
+setup_logging(
+    log_file=os.getenv("LOG_FILE", "app.log") or None,
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    module_levels=parse_levels(os.getenv("LOG_LEVELS")),
+    traceback_burst=int(os.getenv("LOG_TRACEBACK_BURST", "5")),
+    traceback_window=float(os.getenv("LOG_TRACEBACK_WINDOW", "60")),
 )
 logger = logging.getLogger(__name__)
 
 # Import our modules
 from vision import VisionProcessor
 from gpt_handler import NutritionAnalyzer, UserProfile, get_user_profile
+from responses import FastJSONResponse, compact_scan_payload, parse_fields
+from admission import AdmissionController, AdmissionRejected
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -31,18 +37,30 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Add CORS middleware to allow frontend requests
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Adjust this in production to your frontend domain
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # Initialize our processors
 vision_processor = VisionProcessor()
-nutrition_analyzer = NutritionAnalyzer()
+# Cheap model tried first; set GEMINI_CASCADE_MODEL="" to always use the larger model
+nutrition_analyzer = NutritionAnalyzer(
+    cascade_model_name=os.getenv("GEMINI_CASCADE_MODEL", "gemini-2.0-flash-lite"),
+    raw_text_token_budget=int(os.getenv("PROMPT_RAW_TEXT_TOKENS", "200")),
+    product_cache_size=int(os.getenv("PRODUCT_CACHE_SIZE", "10000")),
+    product_cache_ttl=float(os.getenv("PRODUCT_CACHE_TTL", str(24 * 3600))),
+)
+
+# Maximum number of panel images accepted by a multi-image scan
+MAX_SCAN_IMAGES = int(os.getenv("MAX_SCAN_IMAGES", "6"))
+
+# Admission control for the expensive scan endpoints, shared by all workers on the host
+admission_controller = AdmissionController(
+    db_path=os.getenv("ADMISSION_DB"),
+    rate=float(os.getenv("SCAN_RATE_PER_SECOND", "0.5")),
+    burst=int(os.getenv("SCAN_BURST", "5")),
+    ip_rate=float(os.getenv("SCAN_IP_RATE_PER_SECOND", "2")),
+    ip_burst=int(os.getenv("SCAN_IP_BURST", "20")),
+    max_in_flight=int(os.getenv("SCAN_MAX_IN_FLIGHT", "8")),
+    max_queue=int(os.getenv("SCAN_MAX_QUEUE", "16")),
+    queue_timeout=float(os.getenv("SCAN_QUEUE_TIMEOUT", "5")),
+)
 
 # In-memory user profile storage
 current_user_profile = None
@@ -65,20 +83,64 @@ class UserProfileUpdate(BaseModel):
     daily_calorie_target: Optional[int] = None
     activity_level: Optional[str] = None
 
+def render_scan_response(response: ScanResponse, compact: bool, fields: Optional[str]):
+    """Return the full response, or a de-duplicated one when compact mode or fields are requested"""
+    selected = parse_fields(fields)
+    if not compact and not selected:
+        return response
+    return FastJSONResponse(content=compact_scan_payload(response.model_dump(), selected))
+
+# Admission control middleware, registered before the error handling middleware so
+# it runs inside it (with the request ID set)
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    """Rate limit scans by client IP and user ID and cap concurrent scans, before the upload is read"""
+    if not request.url.path.startswith("/api/scan"):
+        return await call_next(request)
+    client_ip = request.client.host if request.client else "unknown"
+    try:
+        slot_id = await admission_controller.acquire(client_ip, request.headers.get("x-user-id"))
+    except AdmissionRejected as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"detail": str(e)},
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+    try:
+        return await call_next(request)
+    finally:
+        await admission_controller.release(slot_id)
+
 # Error handling middleware
 @app.middleware("http")
 async def error_handling_middleware(request: Request, call_next):
+    # Tag every log record of this request (including worker threads) with its ID
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
     try:
         response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
         return response
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error processing request: {str(e)}")
         return JSONResponse(
             status_code=500,
             content={"success": False, "error": "Internal server error"}
         )
 
+# Add CORS middleware to allow frontend requests
+# (added last so it wraps the middlewares above and their 429/503/500 responses get CORS headers)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Adjust this in production to your frontend domain
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Compress large responses (full scan responses are several KB)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Get user from header (simple auth)
 async def get_current_user(x_user_id: Optional[str] = Header(None)) -> Optional[UserProfile]:
     """Get user profile from header"""
@@ -98,6 +160,9 @@ async def get_current_user(x_user_id: Optional[str] = Header(None)) -> Optional[
 async def scan_product(
     file: UploadFile = File(...),
     product_name: Optional[str] = Form(None),
+    compact: bool = Query(False),
+    fields: Optional[str] = Query(None),
+    explain: bool = Query(False),
 ):
     """Analyze a product image and provide nutrition insights"""
     try:
@@ -105,7 +170,7 @@ async def scan_product(
         contents = await file.read()
         
         # Process the image with Vision API
-        vision_result = vision_processor.analyze_product_image(contents)
+        vision_result = await asyncio.to_thread(vision_processor.analyze_product_image, contents)
         
         if not vision_result.get("success"):
             return ScanResponse(
@@ -116,27 +181,104 @@ async def scan_product(
         # Get nutrition data
         nutrition_data = vision_result.get("nutrition_facts", {})
         
-        # Analyze nutrition with user profile context
-        analysis = nutrition_analyzer.analyze_nutrition(
+        # Cached product analysis plus a local overlay for the current user profile
+        analysis = await asyncio.to_thread(
+            nutrition_analyzer.analyze_personalized,
             nutrition_data=nutrition_data,
             user_profile=current_user_profile,  # Pass the current user profile
-            product_name=product_name
+            product_name=product_name,
+            explain=explain
         )
         
         # Get visual verdict
         visual_verdict = nutrition_analyzer.get_visual_verdict(analysis)
         
-        return ScanResponse(
+        return render_scan_response(ScanResponse(
             success=True,
             product_name=product_name,
             nutrition_data=nutrition_data,
             analysis=analysis,
             visual_verdict=visual_verdict
+        ), compact, fields)
+        
+    except Exception as e:
+        logger.exception(f"Error in scan_product: {str(e)}")
+        return ScanResponse(
+            success=False,
+            error=str(e)
+        )
+
+@app.post("/api/scan/multi", response_model=ScanResponse)
+async def scan_product_multi(
+    files: List[UploadFile] = File(...),
+    product_name: Optional[str] = Form(None),
+    compact: bool = Query(False),
+    fields: Optional[str] = Query(None),
+    explain: bool = Query(False),
+):
+    """Analyze several images of one product (front, back, sides) as a single scan"""
+    try:
+        if len(files) > MAX_SCAN_IMAGES:
+            return ScanResponse(
+                success=False,
+                error=f"Too many images: at most {MAX_SCAN_IMAGES} are allowed per scan"
+            )
+        
+        # Read all image files
+        images = [await file.read() for file in files]
+        
+        # Run OCR on every panel concurrently so latency stays close to a single image
+        logger.info(f"Running OCR on {len(images)} panels concurrently")
+        results = await asyncio.gather(*(
+            asyncio.to_thread(vision_processor.detect_nutrition_facts, image)
+            for image in images
+        ), return_exceptions=True)
+        
+        # A failed panel is skipped; the scan only fails when no panel is usable
+        panels = []
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.warning(f"OCR failed for panel {index + 1} of {len(results)}: {str(result)}")
+            else:
+                panels.append(result)
+        
+        if not panels:
+            return ScanResponse(
+                success=False,
+                error="Failed to analyze any of the images"
+            )
+        
+        # Merge the panels into one set of nutrition facts
+        nutrition_data = vision_processor.merge_nutrition_facts(panels)
+        
+        if "error" in nutrition_data:
+            return ScanResponse(
+                success=False,
+                error=nutrition_data["error"]
+            )
+        
+        # Single analysis on the merged data
+        analysis = await asyncio.to_thread(
+            nutrition_analyzer.analyze_personalized,
+            nutrition_data=nutrition_data,
+            user_profile=current_user_profile,
+            product_name=product_name,
+            explain=explain
         )
         
+        # Get visual verdict
+        visual_verdict = nutrition_analyzer.get_visual_verdict(analysis)
+        
+        return render_scan_response(ScanResponse(
+            success=True,
+            product_name=product_name,
+            nutrition_data=nutrition_data,
+            analysis=analysis,
+            visual_verdict=visual_verdict
+        ), compact, fields)
+        
     except Exception as e:
-        logger.error(f"Error in scan_product: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error in scan_product_multi: {str(e)}")
         return ScanResponse(
             success=False,
             error=str(e)
@@ -159,6 +301,11 @@ async def health_check():
             content={"status": "unhealthy", "error": str(e)}
         )
 
+@app.get("/api/stats/analysis")
+async def analysis_stats():
+    """Per-model routing, latency and cost counters for the analysis cascade"""
+    return nutrition_analyzer.get_tier_stats()
+
 @app.post("/api/user/profile")
 async def update_user_profile(profile: UserProfileUpdate):
     """Update the current user's profile"""
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Ingredient keywords that conflict with common dietary restrictions
+RESTRICTION_KEYWORDS = {
+    "vegan": ["milk", "whey", "casein", "lactose", "ghee", "cream", "cheese", "egg", "honey", "gelatin",
+              "meat", "beef", "pork", "chicken", "fish", "anchovy", "shellfish", "lard", "carmine"],
+    "vegetarian": ["meat", "beef", "pork", "chicken", "fish", "anchovy", "shellfish", "gelatin", "lard", "carmine"],
+    "gluten-free": ["wheat", "barley", "rye", "malt", "spelt", "gluten"],
+    "dairy-free": ["milk", "whey", "casein", "lactose", "ghee", "cream", "cheese", "yogurt"],
+    "nut-free": ["peanut", "almond", "cashew", "hazelnut", "walnut", "pecan", "pistachio"],
+    "halal": ["pork", "lard", "gelatin", "alcohol", "wine"],
+}
+
+# Share of the daily calorie target above which a single item only partially fits
+CALORIE_SHARE_LIMIT = 0.25
+
+# "gluten-free", "free from milk" and the like declare an absence, not an ingredient
+# (hyphenated only: "milk, free range eggs" must still match milk)
+FREE_FROM = re.compile(r"\b\w+-free\b|\bfree from \w+")
+
+# Words that contain an allergen name without containing the allergen
+NOT_ALLERGENS = {"eggplant", "coconut", "nutmeg", "butternut"}
+
+def _normalize(term: str) -> str:
+    term = term.lower().strip()
+    return term[:-1] if term.endswith("s") else term
+
+def _haystack(texts: List[str]) -> str:
+    return FREE_FROM.sub(" ", ", ".join(texts).lower())
+
+def _mentions(term: str, haystack: str) -> bool:
+    """Whole-word match of a term or its plural ("egg" matches "eggs", not "eggplant")"""
+    term = _normalize(term)
+    if not term:
+        return False
+    pattern = r"\s+".join(re.escape(word) for word in term.split())
+    return re.search(rf"\b{pattern}(?:s|es)?\b", haystack) is not None
+
+def _mentions_allergen(allergy: str, haystack: str) -> bool:
+    """
+    Match an allergy anywhere in a word ("soy" matches "soybean", "milk" matches
+    "buttermilk"), except in the known false hits of NOT_ALLERGENS
+
+    Looser than _mentions on purpose: missing an allergen is worse than a false warning.
+    """
+    allergy = _normalize(allergy)
+    if not allergy:
+        return False
+    pattern = r"\s+".join(re.escape(word) for word in allergy.split())
+    return any(_normalize(match.group(0)) not in NOT_ALLERGENS
+               for match in re.finditer(rf"\b\w*{pattern}\w*", haystack))
+
+def find_allergen_conflicts(allergies: List[str], ingredients: List[str], warnings: List[str]) -> List[str]:
+    """Return the user's allergies that appear in the ingredients or the product allergen warnings"""
+    haystack = _haystack(ingredients + warnings)
+    return [allergy for allergy in allergies if _mentions_allergen(allergy, haystack)]
+
+def find_restriction_conflicts(restrictions: List[str], ingredients: List[str]) -> Dict[str, List[str]]:
+    """Return the ingredient keywords that break each dietary restriction"""
+    haystack = _haystack(ingredients)
+    conflicts = {}
+    for restriction in restrictions:
+        keywords = RESTRICTION_KEYWORDS.get(restriction.lower().replace(" ", "-"), [])
+        found = [keyword for keyword in keywords if _mentions(keyword, haystack)]
+        if found:
+            conflicts[restriction] = found
+    return conflicts
+
+def product_key(nutrition_data: Dict, product_name: Optional[str] = None) -> Optional[str]:
+    """
+    Key a product-level analysis by the label it was computed from
+
+    Parsed macros alone are not unique (many products have 140 kcal and no
+    parsed ingredients), so the normalized OCR text is always part of the key.
+    Returns None (do not cache) when there is nothing to identify the product by.
+    """
+    fields = {
+        "product_name": (product_name or "").strip().lower(),
+        "calories": nutrition_data.get("calories"),
+        "fat": nutrition_data.get("fat"),
+        "carbohydrates": nutrition_data.get("carbohydrates"),
+        "protein": nutrition_data.get("protein"),
+        "ingredients": [str(i).strip().lower() for i in nutrition_data.get("ingredients") or []],
+        "raw_text": " ".join((nutrition_data.get("raw_text") or "").lower().split()),
+    }
+    parsed = any(fields[k] is not None for k in ("calories", "fat", "carbohydrates", "protein"))
+    if not parsed and not fields["ingredients"] and not fields["raw_text"]:
+        return None
+    fields["raw_text"] = hashlib.sha256(fields["raw_text"].encode("utf-8")).hexdigest()
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+def calorie_fit(calories: Optional[float], daily_calorie_target: Optional[int]) -> Optional[Dict]:
+    """Share of the daily calorie target used by one serving"""
+    if not calories or not daily_calorie_target:
+        return None
+    share = calories / daily_calorie_target
+    return {
+        "calories": calories,
+        "daily_calorie_target": daily_calorie_target,
+        "share_of_target": round(share, 3),
+        "within_limit": share <= CALORIE_SHARE_LIMIT,
+    }
+
+def personalize(base_analysis: Dict, nutrition_data: Dict, user_profile) -> Dict:
+    """
+    Compute the per-user overlay on top of a product-level analysis, without an LLM call
+
+    Args:
+        base_analysis: Profile-independent analysis fields
+        nutrition_data: Dictionary containing nutrition facts
+        user_profile: The user's profile, or None
+
+    Returns:
+        Dictionary with fit_for_user, explanation and the conflicts behind them
+    """
+    if user_profile is None:
+        return {
+            "fit_for_user": "Unknown",
+            "explanation": "Set up your profile to see how this fits your goals.",
+            "allergen_conflicts": [],
+            "restriction_conflicts": {},
+            "calorie_fit": None,
+        }
+
+    ingredients = [str(i) for i in nutrition_data.get("ingredients") or []]
+    warnings = [str(w) for w in base_analysis.get("allergen_warnings") or []]
+
+    allergen_conflicts = find_allergen_conflicts(user_profile.allergies, ingredients, warnings)
+    restriction_conflicts = find_restriction_conflicts(user_profile.dietary_restrictions, ingredients)
+    calories = calorie_fit(nutrition_data.get("calories"), user_profile.daily_calorie_target)
+
+    try:
+        health_score = int(base_analysis.get("health_score", 5))
+    except (TypeError, ValueError):
+        health_score = 5
+
+    reasons = []
+    if allergen_conflicts:
+        reasons.append(f"⚠️ It contains {', '.join(allergen_conflicts)}, which you're allergic to.")
+    for restriction, found in restriction_conflicts.items():
+        reasons.append(f"🚫 It doesn't look {restriction}: it lists {', '.join(found)}.")
+
+    if reasons:
+        fit = "No"
+    else:
+        fit = "Yes"
+        if calories and not calories["within_limit"]:
+            fit = "Partially"
+            reasons.append(f"🔥 One serving is {calories['share_of_target']:.0%} of your "
+                           f"{calories['daily_calorie_target']} kcal daily target.")
+        if user_profile.weight_goal == "lose" and health_score < 6:
+            fit = "Partially"
+            reasons.append("⚖️ It's not the best pick for your weight loss goal, so keep portions small.")
+        if user_profile.health_conditions and health_score < 6:
+            fit = "Partially"
+            reasons.append(f"🩺 Go easy on it given your {', '.join(user_profile.health_conditions)}.")
+        if fit == "Yes":
+            reasons.append("✅ Nothing in it conflicts with your profile.")
+            if calories:
+                reasons.append(f"One serving is {calories['share_of_target']:.0%} of your daily calorie target.")
+
+    return {
+        "fit_for_user": fit,
+        "explanation": " ".join(reasons),
+        "allergen_conflicts": allergen_conflicts,
+        "restriction_conflicts": restriction_conflicts,
+        "calorie_fit": calories,
+    }
@@ -0,0 +1,159 @@
+import re
+from typing import Dict, List, Optional
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_INSTRUCTIONS = """You are a friendly nutrition assistant analyzing a scanned food product for a mobile app.
+Requirements:
+1. Give a health assessment of the food item.
+2. Identify positive nutritional aspects and potential concerns.
+3. Use a friendly, conversational tone with short, impactful statements and emoji, easy to scan on a phone.
+4. If the food is not healthy, suggest healthier alternatives that can be found in the store.
+5. If the food is healthy, suggest ways to enjoy it in a balanced way.
+6. Write like you are talking to the user.
+7. If the product is not food, say that you cannot analyze it.
+"""
+
+_PROFILE_INSTRUCTIONS = """If a user profile is given, also:
+- evaluate whether the food fits their dietary preferences and restrictions
+- flag ingredients that conflict with their allergies as warnings
+- judge whether it suits their weight goal and health conditions
+- say how it fits their daily calorie target
+- talk to them like a friend
+"""
+
+_OUTPUT = """Parsed fields are more reliable than the OCR excerpt; use the excerpt for anything they miss.
+Return ONLY a valid JSON object with these fields:
+{"summary":"one-sentence overview with emoji",
+"health_score":"number from 1-10, 10 being extremely healthy",
+"positive_aspects":["2-3 positive nutritional aspects with emoji"],
+"concerns":["2-3 nutritional concerns with emoji"],
+"allergen_warnings":["potential allergens found in ingredients"],
+"alternatives":["2-3 healthier alternatives by store product name, if applicable"],
+"tips":["1-2 tips on enjoying this food in a balanced way"]"""
+
+_FIT_FIELDS = (',\n"fit_for_user":"Yes/No/Partially",'
+               '\n"explanation":"2-3 sentences explaining the fit assessment"')
+
+# Static instructions and output schema, built once and sent as the system instruction
+SYSTEM_INSTRUCTION = _INSTRUCTIONS + _PROFILE_INSTRUCTIONS + _OUTPUT + _FIT_FIELDS + "}"
+
+# Profile-independent variant used for the cached product-level assessment
+PRODUCT_SYSTEM_INSTRUCTION = _INSTRUCTIONS + _OUTPUT + "}"
+
+# OCR lines mentioning these are the most useful context for the model
+RELEVANT_TERMS = re.compile(
+    r"nutrition|serving|calorie|kcal|kj|fat|saturated|trans|cholesterol|sodium|salt|carb|fiber|fibre|"
+    r"sugar|protein|vitamin|calcium|iron|potassium|ingredient|contains|allergen|may contain|"
+    r"milk|egg|peanut|nut|soy|wheat|gluten|fish|shellfish|sesame|organic|vegan|vegetarian|halal|kosher",
+    re.IGNORECASE
+)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+def trim_raw_text(raw_text: str, token_budget: int) -> str:
+    """
+    Keep the most relevant OCR lines within a token budget
+
+    Lines with nutrition or allergen terms rank first, then lines with numbers,
+    then the rest. Duplicates are dropped and the original order is kept. The
+    best line that does not fit is truncated into whatever budget is left.
+
+    Args:
+        raw_text: The raw text from OCR
+        token_budget: Maximum estimated tokens of the returned text
+
+    Returns:
+        Trimmed text
+    """
+    if not raw_text or token_budget <= 0:
+        return ""
+    if estimate_tokens(raw_text) <= token_budget:
+        return raw_text
+
+    seen = set()
+    candidates = []
+    for index, line in enumerate(raw_text.split("\n")):
+        line = " ".join(line.split())
+        if not line or line.lower() in seen:
+            continue
+        seen.add(line.lower())
+        score = 2 if RELEVANT_TERMS.search(line) else 1 if any(c.isdigit() for c in line) else 0
+        candidates.append((score, index, line))
+
+    kept = []
+    used = 0
+    skipped = None
+    for score, index, line in sorted(candidates, key=lambda c: (-c[0], c[1])):
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            if skipped is None:
+                skipped = (index, line)
+            continue
+        kept.append((index, line))
+        used += cost
+
+    # Fill what is left with the start of the best line that did not fit, so a
+    # single long OCR line still yields an excerpt
+    remaining = token_budget - used - 1
+    if skipped is not None and remaining >= 8:
+        index, line = skipped
+        cut = line[:remaining * 4]
+        if " " in cut[len(cut) // 2:]:
+            cut = cut[:cut.rindex(" ")]
+        kept.append((index, cut))
+
+    return "\n".join(line for _, line in sorted(kept))
+
+def _join(values: Optional[List[str]]) -> str:
+    return ", ".join(values) if values else "none"
+
+def build_user_prompt(nutrition_data: Dict,
+                      user_profile=None,
+                      raw_text_token_budget: int = 200,
+                      product_only: bool = False) -> str:
+    """
+    Build the per-request part of the prompt
+
+    Args:
+        nutrition_data: Dictionary containing nutrition facts
+        user_profile: Optional user profile for personalized recommendations
+        raw_text_token_budget: Token budget for the OCR excerpt
+        product_only: Whether this is for the profile-independent assessment
+
+    Returns:
+        Compact prompt with only the product (and profile) data
+    """
+    def value(key: str, unit: str = "") -> str:
+        v = nutrition_data.get(key)
+        return f"{v}{unit}" if v is not None else "unknown"
+
+    lines = ["Product:"]
+    if nutrition_data.get("product_name"):
+        lines.append(f"name: {nutrition_data['product_name']}")
+    lines.append(
+        f"calories: {value('calories', ' kcal')}; fat: {value('fat', 'g')}; "
+        f"carbohydrates: {value('carbohydrates', 'g')}; protein: {value('protein', 'g')}"
+    )
+    lines.append(f"ingredients: {_join(nutrition_data.get('ingredients'))}")
+
+    excerpt = trim_raw_text(nutrition_data.get("raw_text") or "", raw_text_token_budget)
+    if excerpt:
+        lines.append(f"OCR excerpt:\n{excerpt}")
+
+    if user_profile:
+        lines.append("User profile:")
+        lines.append(f"name: {user_profile.name or 'User'}; weight goal: {user_profile.weight_goal or 'not specified'}; "
+                     f"activity level: {user_profile.activity_level or 'not specified'}; "
+                     f"daily calorie target: {user_profile.daily_calorie_target or 'not specified'}")
+        lines.append(f"dietary restrictions: {_join(user_profile.dietary_restrictions)}")
+        lines.append(f"allergies: {_join(user_profile.allergies)}")
+        lines.append(f"health conditions: {_join(user_profile.health_conditions)}")
+    elif not product_only:
+        lines.append("No user profile.")
+
+    return "\n".join(lines)
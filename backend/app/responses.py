@@ -0,0 +1,141 @@
+import json
+import time
+from typing import Any, Dict, List, Optional
+from starlette.responses import JSONResponse
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Use orjson when available, it serializes several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Keys of the Gemini analysis that are already copied into the visual verdict
+# (summary is its title, health_score is repeated as is)
+VERDICT_KEYS = ["summary", "health_score", "positive_aspects", "concerns", "alternatives", "tips",
+                "fit_for_user", "explanation"]
+
+def dumps(content: Any) -> bytes:
+    """Serialize content to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when installed"""
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def compact_scan_payload(payload: Dict, fields: Optional[List[str]] = None) -> Dict:
+    """
+    Remove duplicated data from a scan response and optionally select fields
+
+    Args:
+        payload: Full scan response as a dictionary
+        fields: Optional list of top-level fields to keep
+
+    Returns:
+        Compact dictionary with each piece of data present only once
+    """
+    compact = {
+        "success": payload.get("success"),
+        "product_name": payload.get("product_name"),
+        "error": payload.get("error"),
+    }
+
+    # Nutrition data (with the raw OCR text) only at the top level, not again inside analysis
+    if payload.get("nutrition_data") is not None:
+        compact["nutrition_data"] = payload["nutrition_data"]
+
+    # Only the model output, minus what the visual verdict already carries when it is returned too
+    verdict_included = payload.get("visual_verdict") is not None and (not fields or "visual_verdict" in fields)
+    analysis = payload.get("analysis")
+    if analysis is not None:
+        if analysis.get("success"):
+            inner = analysis.get("analysis", {})
+            if verdict_included:
+                inner = {k: v for k, v in inner.items() if k not in VERDICT_KEYS}
+            compact["analysis"] = inner
+        else:
+            compact["analysis"] = {k: v for k, v in analysis.items() if k != "nutrition_data"}
+
+    if payload.get("visual_verdict") is not None:
+        compact["visual_verdict"] = payload["visual_verdict"]
+
+    if fields:
+        # success and error are always kept so clients can detect failures
+        keep = set(fields) | {"success", "error"}
+        compact = {k: v for k, v in compact.items() if k in keep}
+
+    return {k: v for k, v in compact.items() if v is not None}
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma separated ?fields= query parameter"""
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+# Compare payload size and serialization time against the full response
+if __name__ == "__main__":
+    raw_text = "Nutrition Facts\nServing Size 1 bar (40g)\nCalories 240\nTotal Fat 12g\nSaturated Fat 6g\nSodium 150mg\nTotal Carbohydrate 30g\nDietary Fiber 2g\nSugars 15g\nProtein 5g\nIngredients:\nWheat Flour, Sugar, Palm Oil, Cocoa, Salt"
+    nutrition_data = {
+        "calories": 240,
+        "fat": 12.0,
+        "carbohydrates": 30.0,
+        "protein": 5.0,
+        "ingredients": ["Wheat Flour", "Sugar", "Palm Oil", "Cocoa", "Salt"],
+        "raw_text": raw_text
+    }
+    model_output = {
+        "summary": "A sweet treat that is best enjoyed occasionally 🍫",
+        "health_score": "4",
+        "positive_aspects": ["Some protein 💪", "Quick energy ⚡"],
+        "concerns": ["High in sugar 🍬", "Saturated fat from palm oil 🌴", "Refined flour 🌾"],
+        "allergen_warnings": ["Wheat (gluten)"],
+        "alternatives": ["Nature Valley Protein Bar", "KIND Dark Chocolate Nuts & Sea Salt"],
+        "tips": ["Pair with fruit for fiber 🍎", "Split the bar into two snacks ✂️"],
+        "fit_for_user": "Partially",
+        "explanation": "It fits your calorie target as an occasional snack, but the sugar content works against your weight goal."
+    }
+    analysis = {
+        "success": True,
+        "product_name": "Chocolate Cookie Bar",
+        "nutrition_data": nutrition_data,
+        "analysis": model_output
+    }
+    verdict = {
+        "title": model_output["summary"],
+        "color": "#F44336",
+        "icon": "thumb_down",
+        "health_score": 4,
+        **{key: model_output[key] for key in VERDICT_KEYS if key not in ("summary", "health_score")}
+    }
+    full = {
+        "success": True,
+        "product_name": "Chocolate Cookie Bar",
+        "nutrition_data": nutrition_data,
+        "analysis": analysis,
+        "visual_verdict": verdict,
+        "error": None
+    }
+
+    runs = 20000
+    start = time.perf_counter()
+    for _ in range(runs):
+        full_bytes = json.dumps(full).encode("utf-8")
+    full_time = (time.perf_counter() - start) / runs
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        compact_bytes = dumps(compact_scan_payload(full))
+    compact_time = (time.perf_counter() - start) / runs
+
+    selected_bytes = dumps(compact_scan_payload(full, ["visual_verdict", "nutrition_data"]))
+
+    print(f"Encoder: {'orjson' if orjson is not None else 'json'}")
+    print(f"Full response:     {len(full_bytes)} bytes, {full_time * 1e6:.1f} us")
+    print(f"Compact response:  {len(compact_bytes)} bytes, {compact_time * 1e6:.1f} us")
+    print(f"Selected fields:   {len(selected_bytes)} bytes")
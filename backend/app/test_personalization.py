@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+from personalization import find_allergen_conflicts, find_restriction_conflicts, personalize, product_key
+
+def make_profile(**overrides):
+    profile = {
+        "allergies": [],
+        "dietary_restrictions": [],
+        "health_conditions": [],
+        "daily_calorie_target": None,
+        "weight_goal": None,
+    }
+    profile.update(overrides)
+    return SimpleNamespace(**profile)
+
+def test_allergy_matches_whole_words_and_plurals():
+    assert find_allergen_conflicts(["egg"], ["Eggs", "Sugar"], []) == ["egg"]
+    assert find_allergen_conflicts(["peanuts"], ["Peanut butter"], []) == ["peanuts"]
+    assert find_allergen_conflicts(["tree nuts"], ["Tree nuts (almonds)"], []) == ["tree nuts"]
+
+def test_allergy_matches_compound_words():
+    assert find_allergen_conflicts(["soy"], ["Soybean oil", "Soya lecithin"], []) == ["soy"]
+    assert find_allergen_conflicts(["milk"], ["Buttermilk"], []) == ["milk"]
+    assert find_allergen_conflicts(["milk"], ["Milkfat"], []) == ["milk"]
+
+def test_egg_allergy_does_not_match_eggplant():
+    assert find_allergen_conflicts(["egg"], ["Eggplant", "Olive oil"], []) == []
+    overlay = personalize({"health_score": "8"}, {"ingredients": ["Eggplant"]}, make_profile(allergies=["egg"]))
+    assert overlay["fit_for_user"] != "No"
+
+def test_nut_allergy_does_not_match_coconut():
+    assert find_allergen_conflicts(["nuts"], ["Coconut milk"], []) == []
+
+def test_allergen_warnings_are_checked():
+    assert find_allergen_conflicts(["wheat"], ["Flour"], ["Wheat (gluten)"]) == ["wheat"]
+
+def test_fish_does_not_match_shellfish():
+    assert find_restriction_conflicts(["vegetarian"], ["Shellfish extract"]) == {"vegetarian": ["shellfish"]}
+    assert find_restriction_conflicts(["vegetarian"], ["Crayfish"]) == {}
+
+def test_free_from_claims_are_not_conflicts():
+    assert find_restriction_conflicts(["vegetarian"], ["Shellfish-free broth"]) == {}
+    assert find_restriction_conflicts(["gluten-free"], ["Oats (free from gluten)"]) == {}
+    assert find_allergen_conflicts(["milk"], ["Milk-free chocolate"], []) == []
+    assert find_allergen_conflicts(["milk"], ["Milk", "Sugar-free syrup"], []) == ["milk"]
+    assert find_allergen_conflicts(["milk"], ["Milk", "Free range eggs"], []) == ["milk"]
+
+def test_allergen_conflict_makes_product_unfit():
+    overlay = personalize({"health_score": "8"}, {"ingredients": ["Milk", "Sugar"]}, make_profile(allergies=["milk"]))
+    assert overlay["fit_for_user"] == "No"
+    assert overlay["allergen_conflicts"] == ["milk"]
+
+def test_calorie_share_over_limit_is_partial_fit():
+    overlay = personalize({"health_score": "8"}, {"calories": 600, "ingredients": ["Rice"]},
+                          make_profile(daily_calorie_target=1800))
+    assert overlay["fit_for_user"] == "Partially"
+    assert overlay["calorie_fit"]["share_of_target"] == 0.333
+
+def test_product_key_separates_products_with_the_same_macros():
+    cola = {"calories": 140, "ingredients": [], "raw_text": "Calories 140\nIngredients: Carbonated water, sugar"}
+    juice = {"calories": 140, "ingredients": [], "raw_text": "Calories 140\n100% orange juice"}
+    assert product_key(cola) != product_key(juice)
+    assert product_key(cola) == product_key({**cola, "raw_text": "calories  140\ningredients: carbonated water, SUGAR"})
+
+def test_product_key_is_none_without_label_data():
+    assert product_key({"ingredients": [], "raw_text": "  "}) is None
@@ -0,0 +1,17 @@
+from prompts import estimate_tokens, trim_raw_text
+
+def test_short_text_is_kept_as_is():
+    text = "Calories 240\nProtein 5g"
+    assert trim_raw_text(text, 200) == text
+
+def test_single_oversized_line_is_truncated_within_budget():
+    excerpt = trim_raw_text("a" * 5000, 200)
+    assert excerpt
+    assert estimate_tokens(excerpt) <= 200
+
+def test_relevant_lines_are_kept_first():
+    text = "\n".join(["Lorem ipsum dolor sit amet " * 4] * 3 + ["Calories 240", "Contains: milk, soy"])
+    excerpt = trim_raw_text(text, 12)
+    assert "Calories 240" in excerpt
+    assert "Contains: milk, soy" in excerpt
+    assert estimate_tokens(excerpt) <= 12
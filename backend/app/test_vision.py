@@ -0,0 +1,39 @@
+import pytest
+
+# vision.py needs OpenCV and the Cloud Vision client at import time
+pytest.importorskip("cv2")
+pytest.importorskip("google.cloud.vision")
+
+from vision import VisionProcessor
+
+def make_panel(**fields):
+    panel = {"calories": None, "fat": None, "carbohydrates": None, "protein": None,
+             "ingredients": [], "raw_text": ""}
+    panel.update(fields)
+    return panel
+
+def test_merge_takes_values_from_the_most_complete_panel_and_records_conflicts():
+    front = make_panel(calories=250, raw_text="250 kcal")
+    table = make_panel(calories=240, fat=12.0, carbohydrates=30.0, protein=5.0, raw_text="Nutrition Facts")
+    merged = VisionProcessor.merge_nutrition_facts([front, table])
+    assert merged["calories"] == 240
+    assert merged["fat"] == 12.0
+    assert merged["conflicts"] == {"calories": [240, 250]}
+    assert merged["panel_count"] == 2
+
+def test_merge_skips_failed_panels():
+    table = make_panel(calories=240, raw_text="Calories 240")
+    merged = VisionProcessor.merge_nutrition_facts([{"error": "No text detected in the image"}, table])
+    assert merged["calories"] == 240
+    assert merged["panel_count"] == 1
+    assert merged["conflicts"] == {}
+
+def test_merge_fails_when_every_panel_failed():
+    merged = VisionProcessor.merge_nutrition_facts([{"error": "No text detected in the image"}])
+    assert "error" in merged
+
+def test_merge_keeps_the_longest_ingredient_list():
+    front = make_panel(ingredients=["Oats"])
+    back = make_panel(ingredients=["Oats", "Honey", "Almonds"])
+    merged = VisionProcessor.merge_nutrition_facts([front, back])
+    assert merged["ingredients"] == ["Oats", "Honey", "Almonds"]
@@ -7,7 +7,6 @@ import numpy as np
 from google.cloud.vision_v1 import AnnotateImageResponse
 from PIL import Image
 import logging
-import traceback
 import re
 
 # Configure logging
@@ -24,7 +23,8 @@ class VisionProcessor:
             logger.error(f"Failed to initialize Vision API client: {str(e)}")
             raise
         
-    def preprocess_image(self, image_bytes: bytes) -> bytes:
+    @staticmethod
+    def preprocess_image(image_bytes: bytes) -> bytes:
         """
         Preprocess the image to improve OCR results
         
@@ -61,7 +61,6 @@ class VisionProcessor:
             
         except Exception as e:
             logger.error(f"Error preprocessing image: {str(e)}")
-            logger.error(traceback.format_exc())
             raise
     
     def detect_text(self, image_bytes: bytes, preprocess: bool = True) -> List[str]:
@@ -105,7 +104,6 @@ class VisionProcessor:
             
         except Exception as e:
             logger.error(f"Error in text detection: {str(e)}")
-            logger.error(traceback.format_exc())
             raise
     
     def detect_nutrition_facts(self, image_bytes: bytes) -> Dict:
@@ -120,35 +118,49 @@ class VisionProcessor:
             Dictionary containing nutrition information
         """
         try:
-            # Prepare image for Google Cloud Vision
-            image = vision.Image(content=image_bytes)
-            
-            # Get text detection results
-            logger.info("Sending request to Vision API for nutrition facts detection")
-            response = self.client.text_detection(image=image)
-            
-            if response.error.message:
-                error_msg = f"Vision API error: {response.error.message}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-            
             # Extract the full text
-            if not response.text_annotations:
-                logger.warning("No text detected in the image")
+            full_text = self.detect_full_text(image_bytes)
+            if full_text is None:
                 return {"error": "No text detected in the image"}
             
-            full_text = response.text_annotations[0].description
-            logger.info("Successfully extracted text from nutrition facts")
-            
             # Parse nutrition facts from the text using helper method
             return self._parse_nutrition_facts(full_text)
             
         except Exception as e:
             logger.error(f"Error in nutrition facts detection: {str(e)}")
-            logger.error(traceback.format_exc())
             raise
     
-    def _parse_nutrition_facts(self, text: str) -> Dict:
+    def detect_full_text(self, image_bytes: bytes) -> Optional[str]:
+        """
+        Run a single Vision API text detection and return the full text
+        
+        Args:
+            image_bytes: Raw image bytes
+            
+        Returns:
+            The entire detected text, or None if the image has no text
+        """
+        # Prepare image for Google Cloud Vision
+        image = vision.Image(content=image_bytes)
+        
+        # Get text detection results
+        logger.info("Sending request to Vision API for nutrition facts detection")
+        response = self.client.text_detection(image=image)
+        
+        if response.error.message:
+            error_msg = f"Vision API error: {response.error.message}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        
+        if not response.text_annotations:
+            logger.warning("No text detected in the image")
+            return None
+        
+        logger.info("Successfully extracted text from nutrition facts")
+        return response.text_annotations[0].description
+    
+    @staticmethod
+    def _parse_nutrition_facts(text: str) -> Dict:
         """
         Parse nutrition facts from detected text
         
@@ -254,7 +266,69 @@ class VisionProcessor:
             
         except Exception as e:
             logger.error(f"Error parsing nutrition facts: {str(e)}")
-            logger.error(traceback.format_exc())
+            raise
+    
+    @staticmethod
+    def merge_nutrition_facts(panels: List[Dict]) -> Dict:
+        """
+        Merge nutrition facts parsed from several images of the same product
+        
+        Each numeric field is taken from the panel that parsed the most
+        nutrition values (the one most likely to be the nutrition table).
+        Disagreeing values are kept under "conflicts" so they can be reviewed.
+        
+        Args:
+            panels: Outputs of detect_nutrition_facts, one per image
+            
+        Returns:
+            Single nutrition facts dictionary in the same shape as _parse_nutrition_facts
+        """
+        try:
+            numeric_fields = ["calories", "fat", "carbohydrates", "protein"]
+            usable = [p for p in panels if p and "error" not in p]
+            
+            if not usable:
+                logger.warning("No text detected in any of the images")
+                return {"error": "No text detected in any of the images"}
+            
+            # Rank panels by how many nutrition values they contributed
+            ranked = sorted(
+                usable,
+                key=lambda p: sum(p.get(field) is not None for field in numeric_fields),
+                reverse=True
+            )
+            
+            result = {
+                "calories": None,
+                "fat": None,
+                "carbohydrates": None,
+                "protein": None,
+                "ingredients": [],
+                "raw_text": "\n\n".join(p.get("raw_text", "") for p in usable),
+                "panel_count": len(usable),
+                "conflicts": {}
+            }
+            
+            for field in numeric_fields:
+                values = [p.get(field) for p in ranked if p.get(field) is not None]
+                if not values:
+                    continue
+                result[field] = values[0]
+                if len(set(values)) > 1:
+                    result["conflicts"][field] = values
+                    logger.debug(f"Conflicting {field} values across panels: {values}")
+            
+            # The ingredients panel usually yields the longest list
+            result["ingredients"] = max(
+                (p.get("ingredients") or [] for p in usable),
+                key=len
+            )
+            
+            logger.info(f"Merged nutrition facts from {len(usable)} panels")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error merging nutrition facts: {str(e)}")
             raise
     
     def analyze_product_image(self, image_bytes: bytes) -> Dict:
@@ -287,8 +361,7 @@ class VisionProcessor:
             
         except Exception as e:
             error_msg = f"Error analyzing product image: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            logger.exception(error_msg)
             return {
                 "success": False,
                 "error": error_msg
@@ -35,6 +35,32 @@ export const scanProduct = async (imageFile, productName = null, userId = null)
     }
 };
 
+export const scanProductImages = async (imageFiles, productName = null, userId = null) => {
+    const formData = new FormData();
+    imageFiles.forEach((imageFile) => formData.append('files', imageFile));
+    if (productName) {
+        formData.append('product_name', productName);
+    }
+
+    const headers = {};
+    if (userId) {
+        headers['X-User-ID'] = userId;
+    }
+
+    try {
+        const response = await api.post('/api/scan/multi', formData, {
+            headers: {
+                ...headers,
+                'Content-Type': 'multipart/form-data',
+            },
+        });
+        return response.data;
+    } catch (error) {
+        console.error('Error scanning product images:', error);
+        throw error;
+    }
+};
+
 export const checkHealth = async () => {
     try {
         const response = await api.get('/api/health');